@@ -1,43 +1,109 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import sqlite3
-from datetime import datetime
+from contextlib import closing
+from datetime import datetime, date as date_type
 import plotly.express as px
 import hashlib
-import re
-from config import get_gemini_response   # Import Gemini helper
+import hmac
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
+from config import stream_gemini, keyword_category, llm_category   # Import Gemini helpers
 
 # --------------------------- DATABASE SETUP ---------------------------
-conn = sqlite3.connect('finwise.db', check_same_thread=False)
-c = conn.cursor()
-
-# Create table for users
-c.execute('''
+DB_PATH = 'finwise.db'
+
+# journal_mode is stored in the database file; the rest apply per connection
+PRAGMAS = '''
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-65536;
+PRAGMA mmap_size=268435456;
+'''
+
+DDL = '''
+-- Create table for users
 CREATE TABLE IF NOT EXISTS users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     username TEXT UNIQUE,
     email TEXT UNIQUE NOT NULL,
     password TEXT NOT NULL
-)
-''')
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users(email);
 
-# Create table for expenses
-c.execute('''
+-- Create table for expenses
 CREATE TABLE IF NOT EXISTS expenses (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL,
-    date TEXT,
+    date DATE,
     category TEXT,
     amount REAL NOT NULL,
     description TEXT,
     FOREIGN KEY(user_id) REFERENCES users(id)
-)
-''')
-conn.commit()
+);
+CREATE INDEX IF NOT EXISTS idx_expenses_user ON expenses(user_id);
+
+-- Cache of descriptions already categorized by Gemini
+CREATE TABLE IF NOT EXISTS category_cache (
+    description TEXT PRIMARY KEY,
+    category TEXT NOT NULL
+);
+'''
+
+# Bumped when a one-off data migration is added; tracked in PRAGMA user_version
+SCHEMA_VERSION = 1
+
+# v1: expenses.user_id used to hold the username. Numeric usernames were coerced to integers by
+# the column's INTEGER affinity, so match on the text form of every row, not typeof()
+MIGRATE_EXPENSE_USER_IDS = '''
+UPDATE expenses SET user_id = (SELECT id FROM users WHERE users.username = CAST(expenses.user_id AS TEXT))
+WHERE EXISTS (SELECT 1 FROM users WHERE users.username = CAST(expenses.user_id AS TEXT))
+'''
+
+# Hot-path statements kept as constants so SQLite's per-connection statement cache is reused
+_SQL_USER_BY_EMAIL = "SELECT id, username, email, password FROM users WHERE email=?"
+_SQL_ADD_USER = "INSERT INTO users (username, email, password) VALUES (?, ?, ?)"
+_SQL_SET_PASSWORD = "UPDATE users SET password=? WHERE email=?"
+_SQL_GET_CATEGORY = "SELECT category FROM category_cache WHERE description=?"
+_SQL_PUT_CATEGORY = "INSERT OR REPLACE INTO category_cache (description, category) VALUES (?, ?)"
+_SQL_ADD_EXPENSE = "INSERT INTO expenses (user_id, date, category, amount, description) VALUES (?, ?, ?, ?, ?)"
+_SQL_USER_EXPENSES = "SELECT id, date, category, amount, description FROM expenses WHERE user_id=?"
+_SQL_CATEGORY_SUMMARY = "SELECT category, SUM(amount) AS amount FROM expenses WHERE user_id=? GROUP BY category"
+_SQL_MONTHLY_SUMMARY = ("SELECT strftime('%Y-%m', date) AS month, SUM(amount) AS amount FROM expenses "
+                        "WHERE user_id=? GROUP BY month ORDER BY month")
+
+# Hand back DATE columns as datetime.date (explicit, the built-in converter is deprecated)
+sqlite3.register_converter("DATE", lambda b: date_type.fromisoformat(b.decode()))
+
+@st.cache_resource(show_spinner=False)
+def init_db():
+    """Switch the database to WAL and bootstrap the schema once per process"""
+    with closing(sqlite3.connect(DB_PATH)) as boot:
+        boot.executescript("PRAGMA journal_mode=WAL;" + DDL)
+        if boot.execute("PRAGMA user_version").fetchone()[0] < 1:
+            with boot:
+                boot.execute(MIGRATE_EXPENSE_USER_IDS)
+                boot.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+def open_conn():
+    """Open a connection for one browser session (transactions are never shared)"""
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(PRAGMAS)
+    return conn
+
+init_db()
+if "conn" not in st.session_state:
+    st.session_state.conn = open_conn()
+conn = st.session_state.conn
+c = conn.cursor()
 
 # --------------------------- SESSION INIT ---------------------------
 if "logged_in" not in st.session_state:
     st.session_state.logged_in = False
+if "user_id" not in st.session_state:
+    st.session_state.user_id = None
 if "username" not in st.session_state:
     st.session_state.username = None
 if "email" not in st.session_state:
@@ -46,23 +112,60 @@ if "page" not in st.session_state:
     st.session_state.page = "🏠 Home"
 
 # --------------------------- AUTH FUNCTIONS ---------------------------
+# Character-class bit per byte: lower=1, upper=2, digit=4, special=8, disallowed=0
+_PW_CLASS = bytearray(256)
+for _chars, _bit in ((b"abcdefghijklmnopqrstuvwxyz", 1), (b"ABCDEFGHIJKLMNOPQRSTUVWXYZ", 2),
+                     (b"0123456789", 4), (b"@$!%*?&", 8)):
+    for _ch in _chars:
+        _PW_CLASS[_ch] = _bit
+_PW_CLASS = bytes(_PW_CLASS)
+
+# Argon2id with RFC 9106 memory-hard parameters (64 MiB, 3 passes, 4 lanes)
+ph = PasswordHasher(time_cost=3, memory_cost=65536, parallelism=4)
+
 def hash_password(password):
+    return ph.hash(password)
+
+def legacy_hash_password(password):
+    """Old unsalted SHA-256 scheme, only used to verify not-yet-migrated rows"""
     return hashlib.sha256(password.encode()).hexdigest()
 
+def is_legacy_hash(stored):
+    return len(stored) == 64 and all(ch in "0123456789abcdef" for ch in stored)
+
+def verify_password(email, stored, password):
+    """Check password against stored hash, upgrading legacy/outdated hashes on success"""
+    if is_legacy_hash(stored):
+        if not hmac.compare_digest(stored, legacy_hash_password(password)):
+            return False
+    else:
+        try:
+            ph.verify(stored, password)
+        except (VerificationError, InvalidHashError):
+            return False
+        if not ph.check_needs_rehash(stored):
+            return True
+    c.execute(_SQL_SET_PASSWORD, (hash_password(password), email))
+    conn.commit()
+    return True
+
 def validate_password(password):
     """Password must have 8+ chars, 1 upper, 1 lower, 1 number, 1 special char"""
-    pattern = r'^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,}$'
-    return re.match(pattern, password)
+    t = password.encode().translate(_PW_CLASS)   # one C-level pass mapping bytes to class bits
+    return len(t) >= 8 and 0 not in t and 1 in t and 2 in t and 4 in t and 8 in t
 
 def login_user(email, password):
-    c.execute("SELECT * FROM users WHERE email=? AND password=?", (email, hash_password(password)))
-    return c.fetchone()
+    c.execute(_SQL_USER_BY_EMAIL, (email,))
+    user = c.fetchone()
+    if user and verify_password(email, user["password"], password):
+        return user
+    return None
 
 def register_user(username, email, password):
     if not validate_password(password):
         return "invalid"
     try:
-        c.execute("INSERT INTO users (username, email, password) VALUES (?, ?, ?)", (username, email, hash_password(password)))
+        c.execute(_SQL_ADD_USER, (username, email, hash_password(password)))
         conn.commit()
         return True
     except sqlite3.IntegrityError:
@@ -71,10 +174,74 @@ def register_user(username, email, password):
 def reset_password(email, new_password):
     if not validate_password(new_password):
         return "invalid"
-    c.execute("UPDATE users SET password=? WHERE email=?", (hash_password(new_password), email))
+    c.execute(_SQL_SET_PASSWORD, (hash_password(new_password), email))
+    if c.rowcount == 0:
+        # Unknown email. The no-op UPDATE still holds SQLite's write lock until the transaction
+        # ends, so end it; the connection belongs to this session alone, so nothing else is undone
+        conn.rollback()
+        return False
     conn.commit()
     return True
 
+# --------------------------- EXPENSE FUNCTIONS ---------------------------
+def categorize_expense(description):
+    """Keyword match first, then previously learned categories, then Gemini"""
+    desc_norm = description.lower().strip()
+    category = keyword_category(desc_norm)
+    if category:
+        return category
+    c.execute(_SQL_GET_CATEGORY, (desc_norm,))
+    row = c.fetchone()
+    if row:
+        return row["category"]
+    try:
+        category = llm_category(desc_norm)
+    except RuntimeError:
+        return "Other"   # don't remember failed lookups
+    c.execute(_SQL_PUT_CATEGORY, (desc_norm, category))
+    conn.commit()
+    return category
+
+def add_expenses(rows):
+    """Insert (user_id, date, category, amount, description) rows in a single transaction"""
+    with conn:
+        conn.executemany(_SQL_ADD_EXPENSE, rows)
+    # Caches are shared by every session, so invalidate them globally
+    for cached in (load_expenses, build_category_pie, build_monthly_line):
+        cached.clear()
+
+@st.cache_data(ttl=300)
+def load_expenses(user_id):
+    """Load a user's expenses (cleared by add_expenses)"""
+    df = pd.read_sql(_SQL_USER_EXPENSES, conn, params=(user_id,))
+    df["category"] = df["category"].astype("category")
+    return df
+
+def load_category_summary(user_id):
+    """Total spent per category, aggregated in SQLite"""
+    return pd.read_sql(_SQL_CATEGORY_SUMMARY, conn, params=(user_id,))
+
+def load_monthly_summary(user_id):
+    """Total spent per YYYY-MM month, aggregated in SQLite"""
+    return pd.read_sql(_SQL_MONTHLY_SUMMARY, conn, params=(user_id,))
+
+# Figures are cached as objects (not pickled) so plotly doesn't re-validate them on every rerun;
+# st.plotly_chart only reads them
+@st.cache_resource(ttl=300)
+def build_category_pie(user_id):
+    """Pie chart of expenses by category, rebuilt only when expenses change"""
+    category_summary = load_category_summary(user_id)
+    return px.pie(category_summary, values="amount", names="category",
+                  title="Expenses by Category", color_discrete_sequence=px.colors.qualitative.Set2)
+
+@st.cache_resource(ttl=300)
+def build_monthly_line(user_id):
+    """Line chart of monthly expense totals, rebuilt only when expenses change"""
+    monthly = load_monthly_summary(user_id)
+    return px.line(monthly, x="month", y="amount",
+                   title="Monthly Expense Trend", markers=True,
+                   line_shape="spline", color_discrete_sequence=["#2E86C1"])
+
 # --------------------------- PAGE CONFIG ---------------------------
 st.set_page_config(page_title="FinWise", layout="wide", page_icon="💰")
 
@@ -108,8 +275,9 @@ if not st.session_state.logged_in:
                 user = login_user(email, password)
                 if user:
                     st.session_state.logged_in = True
-                    st.session_state.username = user[1]
-                    st.session_state.email = user[2]  # email
+                    st.session_state.user_id = user["id"]
+                    st.session_state.username = user["username"]
+                    st.session_state.email = user["email"]
                     st.success(f"Welcome back, {st.session_state.username} 🎉")
                     st.rerun()
                 else:
@@ -152,6 +320,7 @@ else:
     # Logout button at top of sidebar
     if st.sidebar.button("🚪 Logout"):
         st.session_state.logged_in = False
+        st.session_state.user_id = None
         st.session_state.username = None
         st.rerun()
 
@@ -188,20 +357,15 @@ else:
             if submitted:
                 with st.spinner("Categorizing your expense..."):
                 # AI auto-categorization
-                    prompt = f"Categorize this expense into one word (Food, Transport, Bills, Entertainment, Other): {description}"
-                    category = get_gemini_response(prompt).strip().split()[0]
-
-                c.execute(
-                        "INSERT INTO expenses (user_id, date, category, amount, description) VALUES (?, ?, ?, ?, ?)",
-                        (st.session_state.username, str(date), category, amount, description)
-                )
-                conn.commit()
+                    category = categorize_expense(description)
+
+                add_expenses([(st.session_state.user_id, str(date), category, amount, description)])
                 st.success(f"✅ Expense added successfully! Auto-categorized as **{category}**")
 
     # --------------------------- DASHBOARD ---------------------------
     elif choice == "📊 Dashboard":
         st.subheader("📊 Expense Dashboard")
-        df = pd.read_sql("SELECT * FROM expenses WHERE user_id=?", conn, params=(st.session_state.username,))
+        df = load_expenses(st.session_state.user_id)
 
         if df.empty:
             st.warning("⚠️ No expenses added yet.")
@@ -212,32 +376,24 @@ else:
 
             # Pie chart by category
             with col1:
-                category_summary = df.groupby("category")["amount"].sum().reset_index()
-                fig1 = px.pie(category_summary, values="amount", names="category",
-                            title="Expenses by Category", color_discrete_sequence=px.colors.qualitative.Set2)
+                fig1 = build_category_pie(st.session_state.user_id)
                 st.plotly_chart(fig1, use_container_width=True)
 
             # Line chart for monthly trend
             with col2:
-                df['date'] = pd.to_datetime(df['date'])
-                monthly = df.groupby(df['date'].dt.to_period("M"))['amount'].sum().reset_index()
-                monthly['date'] = monthly['date'].astype(str)
-                fig2 = px.line(monthly, x="date", y="amount",
-                            title="Monthly Expense Trend", markers=True,
-                            line_shape="spline", color_discrete_sequence=["#2E86C1"])
+                fig2 = build_monthly_line(st.session_state.user_id)
                 st.plotly_chart(fig2, use_container_width=True)
 
             # Savings suggestion
             st.subheader("💡 Savings Suggestion")
-            total_expense = df['amount'].sum()
+            total_expense = float(df["amount"].to_numpy().sum(dtype=np.float64))
             st.metric("Total Expenses", f"₹{total_expense:.2f}")
 
             income = st.number_input("Enter your monthly income (₹)", min_value=0.0, step=1000.0)
             if income > 0:
                 with st.spinner("Calculating smart saving suggestions..."):
                     prompt = f"My monthly income is {income}, my total expenses are {total_expense}. Suggest smart saving strategies."
-                    advice = get_gemini_response(prompt)
-                st.success(advice)
+                    st.write_stream(stream_gemini(prompt))
 
     # --------------------------- INVESTMENT ADVICE ---------------------------
     elif choice == "📈 Investment Advice":
@@ -256,8 +412,7 @@ else:
             My financial goals are: {goals}.
             Please suggest personalized investment strategies in simple, actionable steps.
             """
-            advice = get_gemini_response(prompt)
-            st.success(advice)
+            st.write_stream(stream_gemini(prompt))
 
     # --------------------------- CHATBOT ---------------------------
     elif choice == "🤖 Chatbot":
@@ -266,5 +421,4 @@ else:
 
         if st.button("Get Answer") and user_input.strip():
             with st.spinner("Thinking..."):
-                answer = get_gemini_response(user_input)
-                st.info(answer)
+                st.write_stream(stream_gemini(user_input))
@@ -1,4 +1,10 @@
 import os
+import functools
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
 import streamlit as st
 from dotenv import load_dotenv
 import google.generativeai as genai
@@ -9,15 +15,110 @@ genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
 
 MODEL_NAME = "gemini-2.5-flash"   # change to gemini-2.0-flash if you prefer speed
 
+EXPENSE_CATEGORIES = ("Food", "Transport", "Bills", "Entertainment", "Other")
+
+# Common merchants/keywords resolved locally without a Gemini call
+CATEGORY_KEYWORDS = {
+    "uber": "Transport", "ola": "Transport", "rapido": "Transport", "metro": "Transport",
+    "bus": "Transport", "taxi": "Transport", "petrol": "Transport", "fuel": "Transport",
+    "zomato": "Food", "swiggy": "Food", "grocery": "Food", "groceries": "Food",
+    "restaurant": "Food", "lunch": "Food", "dinner": "Food", "breakfast": "Food",
+    "electricity": "Bills", "rent": "Bills", "water": "Bills", "internet": "Bills",
+    "wifi": "Bills", "recharge": "Bills", "gas": "Bills",
+    "movie": "Entertainment", "movies": "Entertainment", "netflix": "Entertainment",
+    "spotify": "Entertainment", "concert": "Entertainment",
+}
+
+# In-memory LRU of Gemini answers keyed by SHA-1 of (max_output_tokens, prompt)
+_RESPONSE_CACHE_SIZE = 256
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+def _cache_key(prompt: str, max_output_tokens: Optional[int]):
+    return hashlib.sha1(f"{max_output_tokens}:{prompt}".encode()).hexdigest()
+
+def _cache_get(key: str):
+    with _response_cache_lock:
+        text = _response_cache.get(key)
+        if text is not None:
+            _response_cache.move_to_end(key)
+        return text
+
+def _cache_put(key: str, text: str):
+    with _response_cache_lock:
+        _response_cache[key] = text
+        _response_cache.move_to_end(key)
+        if len(_response_cache) > _RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+
+@functools.lru_cache(maxsize=1)
 def get_model():
-    """Return a Gemini model object"""
+    """Return the Gemini model object (built once per process)"""
     return genai.GenerativeModel(MODEL_NAME)
 
-def get_gemini_response(prompt: str,  max_output_tokens: int = 400):
-    """Get response from Gemini"""
+def _generation_config(max_output_tokens: Optional[int]):
+    """Only cap output when asked; thinking tokens count against max_output_tokens"""
+    if max_output_tokens is None:
+        return None
+    return {"max_output_tokens": max_output_tokens}
+
+def get_gemini_response(prompt: str,  max_output_tokens: Optional[int] = None):
+    """Get response from Gemini (repeated prompts are served from memory)"""
+    key = _cache_key(prompt, max_output_tokens)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
     try:
         model = get_model()
-        resp = model.generate_content(prompt)
-        return getattr(resp, "text", str(resp))
+        resp = model.generate_content(prompt, generation_config=_generation_config(max_output_tokens))
+        text = getattr(resp, "text", str(resp))
     except Exception as e:
         return f"Error: {e}"
+    _cache_put(key, text)
+    return text
+
+def stream_gemini(prompt: str, max_output_tokens: Optional[int] = None):
+    """Yield Gemini response text chunk by chunk as it is generated"""
+    key = _cache_key(prompt, max_output_tokens)
+    cached = _cache_get(key)
+    if cached is not None:
+        yield cached
+        return
+    parts = []
+    try:
+        model = get_model()
+        resp = model.generate_content(
+            prompt, stream=True, generation_config=_generation_config(max_output_tokens)
+        )
+        for chunk in resp:
+            try:
+                text = chunk.text
+            except ValueError:   # chunk without a Part, e.g. the final finish_reason chunk
+                continue
+            parts.append(text)
+            yield text
+    except Exception as e:
+        yield f"Error: {e}"
+        return
+    # Only cache answers that streamed to completion
+    _cache_put(key, "".join(parts))
+
+def keyword_category(desc_norm: str):
+    """Return a category from CATEGORY_KEYWORDS for a normalized description, or None"""
+    for word in re.findall(r"[a-z]+", desc_norm):
+        if word in CATEGORY_KEYWORDS:
+            return CATEGORY_KEYWORDS[word]
+    return None
+
+@functools.lru_cache(maxsize=4096)
+def llm_category(desc_norm: str):
+    """Categorize a normalized description with Gemini (raises RuntimeError on API failure)"""
+    prompt = ("Categorize this expense into exactly one word from "
+              f"({', '.join(EXPENSE_CATEGORIES)}). Reply with the word only: {desc_norm}")
+    # No max_output_tokens here: thinking tokens count against it and a tight cap yields empty replies
+    resp = get_gemini_response(prompt)
+    words = resp.split()
+    if resp.startswith("Error:") or not words:
+        raise RuntimeError(resp or "Empty response from Gemini")
+    category = words[0].strip(".,*:").capitalize()
+    return category if category in EXPENSE_CATEGORIES else "Other"